@@ -1,6 +1,8 @@
 from fastapi import FastAPI, HTTPException, Query
 import sqlite3
 import random
+import os
+import sys
 from fastapi.middleware.cors import CORSMiddleware
 
 
@@ -15,6 +17,11 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Record incoming requests for replay.py when MARKET_RECORD_LOG is set
+if os.environ.get("MARKET_RECORD_LOG"):
+    from replay import install_recorder
+    install_recorder(sys.modules[__name__], os.environ["MARKET_RECORD_LOG"])
+
 # Initialize variables
 total_shares = 100  # Total number of shares issued in the IPO
 initial_price = 10  # Starting price per share at the IPO
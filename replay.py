@@ -0,0 +1,359 @@
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+from fastapi import HTTPException
+from fastapi.dependencies.utils import request_params_to_args
+from fastapi.encoders import jsonable_encoder
+from fastapi.routing import APIRoute
+from starlette.datastructures import QueryParams
+
+# Record / replay harness for the trading engine.
+#
+# A request log is a JSON-lines file with one compact entry per request:
+#     ["POST", "/ipo_sale", {"buyer": "Olin", "num_shares": "30"}]
+# Logs are either recorded from a running server (set MARKET_RECORD_LOG, see
+# main.py) or generated with `python replay.py generate`. A recording also
+# saves the server's market.db and engine globals as they were before the first
+# request (<log>.start.db / <log>.start.json), and replay starts from those.
+#
+# Replaying runs every request in-process, one at a time, against that start
+# state (or a fresh database and freshly reset engine), collecting each
+# response plus the final contents of people_to_shares / market_maker /
+# transactions. A run can be saved as a
+# reference and later runs diffed against it, so a performance rewrite can be
+# checked for identical behaviour and timed on the same stream.
+#
+# Concurrency is not covered: recorded requests run one at a time and replay is
+# sequential, so a matching replay says nothing about how a rewrite behaves when
+# requests run concurrently.
+
+PEOPLE = ["Olin", "Mig", "Albert"]
+
+
+# Middleware that logs every engine request to log_path. Each server run starts
+# a new log, since a restart resets the engine globals that a log continues from.
+def install_recorder(engine, log_path):
+    log_file = open(log_path, "w")
+    clear_start(log_path)
+    # Sync endpoints run in a threadpool, so concurrent requests could interleave
+    # their updates in an order the log can't capture. While recording, requests
+    # run one at a time so the log order is the execution order.
+    lock = asyncio.Lock()
+    routes = {}
+
+    @engine.app.middleware("http")
+    async def record_request(request, call_next):
+        # Routes are registered after the recorder is installed, so look them up lazily
+        if not routes:
+            routes.update(build_routes(engine.app))
+        # Skip CORS preflights, /docs, /openapi.json and anything else replay can't serve
+        if (request.method, request.url.path) not in routes:
+            return await call_next(request)
+        async with lock:
+            # The server may have started from an existing market.db, so keep a copy
+            # of where the engine was before the first request
+            if log_file.tell() == 0:
+                save_start(engine, log_path)
+            entry = [request.method, request.url.path, dict(request.query_params)]
+            log_file.write(json.dumps(entry, separators=(",", ":")) + "\n")
+            log_file.flush()
+            return await call_next(request)
+
+    return log_file
+
+
+def start_paths(log_path):
+    return f"{log_path}.start.db", f"{log_path}.start.json"
+
+
+# Save the engine's current database and globals as the starting state for log_path
+def save_start(engine, log_path):
+    db_path, globals_path = start_paths(log_path)
+    source = sqlite3.connect('market.db')
+    target = sqlite3.connect(db_path)
+    source.backup(target)
+    target.close()
+    source.close()
+    with open(globals_path, "w") as f:
+        json.dump({name: getattr(engine, name) for name in ENGINE_GLOBALS}, f)
+
+
+# Starting state recorded for log_path, or None if the log starts from a fresh engine
+def load_start(log_path):
+    db_path, globals_path = start_paths(log_path)
+    if not (os.path.exists(db_path) and os.path.exists(globals_path)):
+        return None
+    with open(globals_path) as f:
+        return {"db": db_path, "engine": json.load(f)}
+
+
+def clear_start(log_path):
+    for path in start_paths(log_path):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def load_log(log_path):
+    requests = []
+    with open(log_path) as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                method, path, params = json.loads(line)
+                requests.append((method, path, params))
+    return requests
+
+
+def save_log(requests, log_path):
+    with open(log_path, "w") as f:
+        for method, path, params in requests:
+            f.write(json.dumps([method, path, params], separators=(",", ":")) + "\n")
+
+
+# Deterministic synthetic request stream, mixing valid trades with the error paths
+def generate_requests(num_requests, seed=0):
+    rng = random.Random(seed)
+    requests = []
+    for _ in range(num_requests):
+        roll = rng.random()
+        person = rng.choice(PEOPLE)
+        num_shares = str(rng.randint(1, 5))
+        if roll < 0.25:
+            requests.append(("POST", "/ipo_sale", {"buyer": person, "num_shares": num_shares}))
+        elif roll < 0.55:
+            requests.append(("POST", "/market_maker_trade", {"buyer": person, "num_shares": num_shares}))
+        elif roll < 0.85:
+            requests.append(("POST", "/market_maker_trade", {"seller": person, "num_shares": num_shares}))
+        elif roll < 0.90:
+            requests.append(("GET", "/balance_sheet", {}))
+        elif roll < 0.95:
+            requests.append(("GET", "/market_data", {}))
+        elif roll < 0.97:
+            requests.append(("POST", "/ipo_sale", {"buyer": "Nobody", "num_shares": num_shares}))
+        elif roll < 0.99:
+            requests.append(("POST", "/market_maker_trade", {"buyer": person, "seller": person}))
+        else:
+            requests.append(("POST", "/market_maker_trade", {"num_shares": num_shares}))
+    return requests
+
+
+ENGINE_GLOBALS = ["shares_sold", "shares_available", "organization_money", "cur_value"]
+
+
+# Put the engine back into the state a freshly started server would have
+def reset_engine(engine):
+    engine.shares_sold = 0
+    engine.shares_available = engine.total_shares
+    engine.organization_money = 0
+    engine.cur_value = engine.initial_price
+    engine.init_db()
+
+
+def build_routes(app):
+    routes = {}
+    for route in app.routes:
+        # Only the engine's own endpoints; /docs and /openapi.json are plain Starlette routes
+        if not isinstance(route, APIRoute):
+            continue
+        for method in route.methods:
+            routes[(method, route.path)] = route
+    return routes
+
+
+# Validate raw query params with FastAPI's own parameter handling, so replay accepts,
+# coerces and rejects exactly what the live server did
+def build_kwargs(route, params):
+    return request_params_to_args(route.dependant.query_params, QueryParams(params))
+
+
+# Call the endpoint for one logged request. Validation errors get FastAPI's 422
+# body; the 404 and 500 bodies are the harness's own, so they only compare
+# against other replays.
+def dispatch(routes, method, path, params):
+    route = routes.get((method, path))
+    if route is None:
+        return {"status_code": 404, "body": {"detail": "Not Found"}}
+    kwargs, errors = build_kwargs(route, params)
+    if errors:
+        return {"status_code": 422, "body": {"detail": jsonable_encoder(errors)}}
+    try:
+        body = route.endpoint(**kwargs)
+    except HTTPException as e:
+        return {"status_code": e.status_code, "body": {"detail": e.detail}}
+    except Exception as e:
+        # Engine bugs are part of its behaviour; record them instead of aborting the replay
+        return {"status_code": 500, "body": {"detail": type(e).__name__}}
+    # Round trip through JSON so responses compare the way a client would see them
+    return {"status_code": 200, "body": json.loads(json.dumps(body))}
+
+
+def snapshot_state(engine):
+    conn = sqlite3.connect('market.db')
+    cursor = conn.cursor()
+
+    cursor.execute('SELECT name, shares, money FROM people_to_shares ORDER BY name')
+    people_to_shares = [list(row) for row in cursor.fetchall()]
+
+    cursor.execute('SELECT id, inventory, cash FROM market_maker ORDER BY id')
+    market_maker = [list(row) for row in cursor.fetchall()]
+
+    cursor.execute('SELECT id, buyer, seller, num_shares, price_per_share, total_amount FROM transactions ORDER BY id')
+    transactions = [list(row) for row in cursor.fetchall()]
+
+    conn.close()
+
+    return {
+        "people_to_shares": people_to_shares,
+        "market_maker": market_maker,
+        "transactions": transactions,
+        "engine": {name: getattr(engine, name) for name in ENGINE_GLOBALS},
+    }
+
+
+# Replay requests in a scratch directory, against a fresh engine or a recorded start
+def replay(requests, start=None):
+    import main as engine
+
+    original_cwd = os.getcwd()
+    # Replay must not leak its engine state into whoever else imported main
+    saved_globals = {name: getattr(engine, name) for name in ENGINE_GLOBALS}
+    with tempfile.TemporaryDirectory() as work_dir:
+        # The engine opens 'market.db' relative to the working directory
+        os.chdir(work_dir)
+        try:
+            if start is None:
+                reset_engine(engine)
+            else:
+                # The recorded database was already initialised by the live server
+                shutil.copyfile(start["db"], 'market.db')
+                for name, value in start["engine"].items():
+                    setattr(engine, name, value)
+            routes = build_routes(engine.app)
+
+            start = time.perf_counter()
+            responses = [dispatch(routes, method, path, params) for method, path, params in requests]
+            elapsed = time.perf_counter() - start
+
+            state = snapshot_state(engine)
+        finally:
+            os.chdir(original_cwd)
+            for name, value in saved_globals.items():
+                setattr(engine, name, value)
+
+    return {
+        "responses": responses,
+        "state": state,
+        "elapsed": elapsed,
+        "requests_per_second": len(requests) / elapsed if elapsed > 0 else float("inf"),
+    }
+
+
+def diff_values(expected, actual, where, differences, rel_tol, abs_tol):
+    if isinstance(expected, float) or isinstance(actual, float):
+        if isinstance(expected, (int, float)) and isinstance(actual, (int, float)) \
+                and math.isclose(expected, actual, rel_tol=rel_tol, abs_tol=abs_tol):
+            return
+        differences.append(f"{where}: expected {expected!r}, got {actual!r}")
+    elif isinstance(expected, dict) and isinstance(actual, dict):
+        for key in sorted(set(expected) | set(actual), key=str):
+            if key not in actual:
+                differences.append(f"{where}.{key}: missing")
+            elif key not in expected:
+                differences.append(f"{where}.{key}: unexpected {actual[key]!r}")
+            else:
+                diff_values(expected[key], actual[key], f"{where}.{key}", differences, rel_tol, abs_tol)
+    elif isinstance(expected, list) and isinstance(actual, list):
+        if len(expected) != len(actual):
+            differences.append(f"{where}: expected {len(expected)} items, got {len(actual)}")
+        for i, (e, a) in enumerate(zip(expected, actual)):
+            diff_values(e, a, f"{where}[{i}]", differences, rel_tol, abs_tol)
+    elif expected != actual:
+        differences.append(f"{where}: expected {expected!r}, got {actual!r}")
+
+
+# List every difference in responses and final state between two runs
+def compare_runs(reference, result, rel_tol=1e-9, abs_tol=0.0):
+    differences = []
+    diff_values(reference["responses"], result["responses"], "responses", differences, rel_tol, abs_tol)
+    diff_values(reference["state"], result["state"], "state", differences, rel_tol, abs_tol)
+    return differences
+
+
+def save_reference(result, reference_path):
+    with open(reference_path, "w") as f:
+        json.dump({"responses": result["responses"], "state": result["state"]}, f)
+
+
+def load_reference(reference_path):
+    with open(reference_path) as f:
+        return json.load(f)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Record/replay harness for the trading engine")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    generate_parser = subparsers.add_parser("generate", help="write a synthetic request log")
+    generate_parser.add_argument("log")
+    generate_parser.add_argument("--requests", type=int, default=10000)
+    generate_parser.add_argument("--seed", type=int, default=0)
+
+    run_parser = subparsers.add_parser("run", help="replay a request log")
+    run_parser.add_argument("log")
+    run_parser.add_argument("--reference", help="compare against a saved reference run")
+    run_parser.add_argument("--save-reference", help="save this run as a reference")
+    run_parser.add_argument("--repeat", type=int, default=1, help="replay the log this many times for timing")
+    run_parser.add_argument("--rel-tol", type=float, default=1e-9, help="relative tolerance for float comparisons")
+    run_parser.add_argument("--abs-tol", type=float, default=0.0, help="absolute tolerance for float comparisons")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "generate":
+        save_log(generate_requests(args.requests, args.seed), args.log)
+        # A generated log starts from a fresh engine, not from an old recording
+        clear_start(args.log)
+        print(f"Wrote {args.requests} requests to {args.log}")
+        return 0
+
+    requests = load_log(args.log)
+    start = load_start(args.log)
+    if start is not None:
+        print(f"Starting from recorded state {start['db']}")
+    runs = [replay(requests, start) for _ in range(max(1, args.repeat))]
+    result = runs[0]
+    best = max(run["requests_per_second"] for run in runs)
+    print(f"Replayed {len(requests)} requests x{len(runs)}: best {best:.0f} requests/s")
+
+    # Every repeat must agree with the first, otherwise the engine is not deterministic
+    for run in runs[1:]:
+        if compare_runs(result, run, args.rel_tol, args.abs_tol):
+            print("Replay is not deterministic: repeated runs differ.")
+            return 1
+
+    if args.save_reference:
+        save_reference(result, args.save_reference)
+        print(f"Saved reference to {args.save_reference}")
+
+    if args.reference:
+        differences = compare_runs(load_reference(args.reference), result, args.rel_tol, args.abs_tol)
+        if differences:
+            print(f"{len(differences)} differences from reference:")
+            for difference in differences[:20]:
+                print(f"  {difference}")
+            return 1
+        print("Matches reference.")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,179 @@
+import importlib.util
+import os
+import sqlite3
+import sys
+import pytest
+from fastapi import FastAPI, Query
+from fastapi.testclient import TestClient
+from replay import (
+    generate_requests, save_log, load_log, replay, compare_runs, save_reference, load_reference, main,
+    build_kwargs, build_routes, load_start, snapshot_state
+)
+
+
+@pytest.fixture
+def requests():
+    return generate_requests(500, seed=1)
+
+
+# Test that a log survives a save/load round trip
+def test_log_round_trip(tmp_path, requests):
+    log_path = tmp_path / "requests.log"
+    save_log(requests, log_path)
+    assert load_log(log_path) == requests
+
+# Load a separate copy of main with the recorder installed through MARKET_RECORD_LOG
+def load_recorded_engine(log_path, monkeypatch):
+    import main
+    monkeypatch.setenv("MARKET_RECORD_LOG", str(log_path))
+    spec = importlib.util.spec_from_file_location("recorded_main", main.__file__)
+    engine = importlib.util.module_from_spec(spec)
+    monkeypatch.setitem(sys.modules, "recorded_main", engine)
+    spec.loader.exec_module(engine)
+    return engine
+
+
+# The harness has its own 500 body, and the live server answers with plain text
+def normalise(response):
+    if response["status_code"] == 500:
+        return {"status_code": 500, "body": None}
+    return response
+
+# Test that a stream recorded against the live app replays with the same responses and state
+def test_recorded_stream_matches_live_server(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    log_path = tmp_path / "requests.log"
+    engine = load_recorded_engine(log_path, monkeypatch)
+
+    # Start from a database that is not fresh, like the one a long-running server leaves behind
+    engine.init_db()
+    conn = sqlite3.connect('market.db')
+    conn.execute('UPDATE people_to_shares SET shares = 36 WHERE name = ?', ("Olin",))
+    conn.commit()
+    conn.close()
+
+    engine_requests = [
+        ("POST", "/ipo_sale", {"buyer": "Olin", "num_shares": "5"}),
+        ("POST", "/market_maker_trade", {"buyer": "Mig", "num_shares": "2.0"}),
+        ("POST", "/market_maker_trade", {"seller": "Olin", "num_shares": "3"}),
+        ("POST", "/ipo_sale", {"buyer": "Olin"}),
+        ("POST", "/ipo_sale", {"buyer": "Albert", "num_shares": "0"}),
+        ("POST", "/market_maker_trade", {"buyer": "Albert", "num_shares": "abc"}),
+        ("POST", "/ipo_sale", {"buyer": "Nobody", "num_shares": "1"}),
+        ("POST", "/market_maker_trade", {"buyer": "Olin", "seller": "Mig"}),
+        ("GET", "/balance_sheet", {}),
+        ("GET", "/market_data", {}),
+    ]
+    live_responses = []
+    with TestClient(engine.app, raise_server_exceptions=False) as client:
+        # Neither of these can be replayed, so neither should be recorded
+        client.options("/ipo_sale", headers={"Origin": "http://example.com", "Access-Control-Request-Method": "POST"})
+        client.get("/docs")
+        for method, path, params in engine_requests:
+            response = client.request(method, path, params=params)
+            body = response.json() if response.status_code != 500 else None
+            live_responses.append({"status_code": response.status_code, "body": body})
+    live_state = snapshot_state(engine)
+
+    assert [response["status_code"] for response in live_responses] == [200, 200, 200, 422, 500, 422, 404, 400, 200, 200]
+    assert load_log(log_path) == engine_requests
+
+    result = replay(load_log(log_path), load_start(log_path))
+    result["responses"] = [normalise(response) for response in result["responses"]]
+    assert compare_runs({"responses": live_responses, "state": live_state}, result) == []
+
+# Test that replaying the same stream twice gives identical responses and state
+def test_replay_is_deterministic(requests):
+    first = replay(requests)
+    second = replay(requests)
+    assert len(first["responses"]) == len(requests)
+    assert compare_runs(first, second) == []
+    assert first["requests_per_second"] > 0
+
+# Test that replay leaves the working directory's database alone
+def test_replay_uses_scratch_database(tmp_path, requests):
+    cwd = os.getcwd()
+    os.chdir(tmp_path)
+    try:
+        replay(requests)
+        assert not (tmp_path / "market.db").exists()
+    finally:
+        os.chdir(cwd)
+
+# Test that replay puts the engine globals back the way it found them
+def test_replay_restores_engine_globals(requests):
+    import main
+    main.shares_available = 42
+    try:
+        replay(requests)
+        assert main.shares_available == 42
+    finally:
+        main.shares_available = main.total_shares
+
+# Test replaying a known scenario against the engine
+def test_replay_scenario():
+    result = replay([
+        ("POST", "/ipo_sale", {"buyer": "Olin", "num_shares": "30"}),
+        ("POST", "/market_maker_trade", {"seller": "Olin", "num_shares": "3"}),
+        ("POST", "/ipo_sale", {"buyer": "Nobody", "num_shares": "1"}),
+        ("POST", "/market_maker_trade", {"buyer": "Olin", "seller": "Mig"}),
+        ("GET", "/missing", {}),
+    ])
+    statuses = [response["status_code"] for response in result["responses"]]
+    assert statuses == [200, 200, 404, 400, 404]
+
+    people = {name: (shares, money) for name, shares, money in result["state"]["people_to_shares"]}
+    assert people["Olin"][0] == 27
+    assert people["Mig"] == (0, 1000)
+    assert result["state"]["market_maker"][0][1] == 53
+    assert result["state"]["engine"]["shares_available"] == 70
+
+# Test that query params are validated the way FastAPI does, including required Query(...) ones
+def test_build_kwargs_matches_fastapi_validation():
+    app = FastAPI()
+
+    @app.post("/trade")
+    def trade(buyer: str, num_shares: int = Query(...), seller: str = Query(None)):
+        pass
+
+    route = build_routes(app)[("POST", "/trade")]
+    assert build_kwargs(route, {"buyer": "Olin", "num_shares": "2.0"}) == \
+        ({"buyer": "Olin", "num_shares": 2, "seller": None}, [])
+
+    for params, missing in [({"buyer": "Olin"}, "num_shares"), ({"num_shares": "2"}, "buyer")]:
+        kwargs, errors = build_kwargs(route, params)
+        assert [(error["type"], error["loc"]) for error in errors] == [("missing", ("query", missing))]
+
+    kwargs, errors = build_kwargs(route, {"buyer": "Olin", "num_shares": "2.5"})
+    assert [error["type"] for error in errors] == ["int_parsing"]
+
+# Test that differences in responses and state are reported
+def test_compare_runs_reports_differences(requests):
+    reference = replay(requests)
+    result = replay(requests)
+    result["responses"][0]["status_code"] = 500
+    result["state"]["market_maker"][0][2] += 1.0
+    differences = compare_runs(reference, result)
+    assert len(differences) == 2
+    assert differences[0].startswith("responses[0].status_code")
+    assert differences[1].startswith("state.market_maker[0][2]")
+
+# Test that relative and absolute float tolerances are applied separately
+def test_compare_runs_tolerances():
+    reference = {"responses": [], "state": {"money": 0.0, "cash": 1000.0}}
+    result = {"responses": [], "state": {"money": 0.0005, "cash": 1000.5}}
+    assert compare_runs(reference, result, rel_tol=1e-3) == ["state.money: expected 0.0, got 0.0005"]
+    assert compare_runs(reference, result, rel_tol=1e-3, abs_tol=1e-3) == []
+
+# Test the command line against a saved reference
+def test_cli_reference(tmp_path):
+    log_path = str(tmp_path / "requests.log")
+    reference_path = str(tmp_path / "reference.json")
+    assert main(["generate", log_path, "--requests", "200", "--seed", "3"]) == 0
+    assert main(["run", log_path, "--save-reference", reference_path, "--repeat", "2"]) == 0
+    assert main(["run", log_path, "--reference", reference_path]) == 0
+
+    reference = load_reference(reference_path)
+    reference["state"]["engine"]["cur_value"] += 1
+    save_reference(reference, reference_path)
+    assert main(["run", log_path, "--reference", reference_path]) == 1